@@ -6,7 +6,7 @@ import os
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
 
-from .routers import transcription
+from .routers import transcription, admin
 from .utils.whisper_service import whisper_service
 
 # Cargar variables de entorno
@@ -76,6 +76,12 @@ app.include_router(
     tags=["transcription"]
 )
 
+app.include_router(
+    admin.router,
+    prefix="/api/v1/admin",
+    tags=["admin"]
+)
+
 @app.get("/")
 async def root():
     """Endpoint raíz"""
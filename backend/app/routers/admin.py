@@ -0,0 +1,71 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import FileResponse
+from typing import Optional
+from pathlib import Path
+import logging
+import os
+import secrets
+
+from ..utils.resource_monitor import resource_monitor, SORTABLE_FIELDS
+
+logger = logging.getLogger(__name__)
+
+def verify_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """
+    Exige la cabecera X-Admin-Token igual a la variable ADMIN_TOKEN.
+    Sin ADMIN_TOKEN configurado los endpoints de administración quedan deshabilitados.
+    """
+    admin_token = os.getenv("ADMIN_TOKEN", "")
+    if not admin_token:
+        raise HTTPException(status_code=403, detail="Endpoints de administración deshabilitados")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(status_code=401, detail="Token de administración no válido")
+
+router = APIRouter(dependencies=[Depends(verify_admin_token)])
+
+@router.get("/resources")
+async def get_resource_summary():
+    """
+    Límites configurados, trabajos activos y coste agregado por modelo
+    """
+    return resource_monitor.get_summary()
+
+@router.get("/jobs")
+async def get_jobs(
+    limit: int = Query(50, ge=1, le=1000, description="Número máximo de trabajos"),
+    sort_by: str = Query("started_at", description="Campo por el que ordenar (descendente)")
+):
+    """
+    Lista los trabajos recientes con su consumo de recursos, de más a menos costoso según sort_by
+    """
+    if sort_by not in SORTABLE_FIELDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Campo de ordenación no válido. Campos disponibles: {', '.join(sorted(SORTABLE_FIELDS))}"
+        )
+    return {"jobs": resource_monitor.get_jobs(limit=limit, sort_by=sort_by)}
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Obtiene el consumo de recursos de un trabajo (por job_id o el más reciente con ese task_id)
+    """
+    job = resource_monitor.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo {job_id} no encontrado")
+    return job
+
+@router.get("/jobs/{job_id}/profile")
+async def download_profile(job_id: str):
+    """
+    Descarga el perfil guardado de un trabajo (.prof de cProfile o traza .json del perfilador de torch)
+    """
+    job = resource_monitor.get_job(job_id)
+    if job is None or not job.get("profile_path"):
+        raise HTTPException(status_code=404, detail=f"No hay perfil para el trabajo {job_id}")
+
+    profile_path = Path(job["profile_path"])
+    if not profile_path.exists():
+        raise HTTPException(status_code=404, detail=f"El perfil del trabajo {job_id} ya no existe")
+
+    return FileResponse(profile_path, filename=profile_path.name)
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, BackgroundTasks
+from fastapi import APIRouter, UploadFile, File, Form, Header, HTTPException
 from typing import Optional
 import logging
 import os
@@ -7,24 +7,25 @@ import asyncio
 
 from ..models.schemas import TranscriptionResponse, ErrorResponse, WhisperModel
 from ..utils.whisper_service import whisper_service
-from ..utils.file_handler import save_uploaded_file, cleanup_file
+from ..utils.file_handler import save_uploaded_file
+from ..utils.resource_monitor import resource_monitor, PROFILE_MODES
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 @router.post("/transcribe", response_model=TranscriptionResponse)
 async def transcribe_audio(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(..., description="Archivo de audio a transcribir"),
     model: Optional[str] = Form("base", description="Modelo de Whisper a usar"),
     language: Optional[str] = Form(None, description="Idioma del audio (opcional)"),
     task: Optional[str] = Form("transcribe", description="Tarea: transcribe o translate"),
-    task_id: Optional[str] = Form(None, description="ID único para la tarea (opcional)")
+    task_id: Optional[str] = Form(None, description="ID único para la tarea (opcional)"),
+    profile: Optional[str] = Form(None, description="Perfilar la tarea: cprofile o torch (opcional)"),
+    x_profile: Optional[str] = Header(None, description="Alternativa al campo profile")
 ):
     """
     Transcribe un archivo de audio a texto usando Whisper
     """
-    file_path = None
     # Usar el task_id proporcionado o generar uno nuevo
     if not task_id:
         task_id = str(uuid.uuid4())
@@ -47,24 +48,37 @@ async def transcribe_audio(
                 detail="La tarea debe ser 'transcribe' o 'translate'"
             )
         
+        # Validar perfilado
+        profile = (profile or x_profile or "").strip().lower() or None
+        if profile:
+            if profile not in PROFILE_MODES:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Modo de perfilado no válido. Modos disponibles: {', '.join(sorted(PROFILE_MODES))}"
+                )
+            if not resource_monitor.profiling_enabled:
+                raise HTTPException(
+                    status_code=403,
+                    detail="El perfilado está deshabilitado en este servidor"
+                )
+        
         # Guardar archivo
         upload_dir = os.getenv("UPLOAD_DIR", "uploads")
-        file_path = await save_uploaded_file(file, upload_dir)
+        audio_path = await save_uploaded_file(file, upload_dir)
         
-        # Transcribir de forma asíncrona con ID de tarea
+        # Transcribir de forma asíncrona con ID de tarea. A partir de aquí el servicio
+        # elimina el archivo y descarga el modelo cuando termina el hilo de trabajo,
+        # aunque la petición haya expirado o se haya cancelado
         result = await whisper_service.transcribe_audio_async(
-            audio_path=file_path,
+            audio_path=audio_path,
             model_name=model,
             language=language,
             task=task,
-            task_id=task_id
+            task_id=task_id,
+            profile=profile
         )
         
-        # Programar limpieza del archivo y descargar el modelo para liberar memoria
-        background_tasks.add_task(cleanup_file, file_path)
-        background_tasks.add_task(whisper_service.unload_model, model)
-        
-        logger.info(f"Transcripción completada - Se descargará el modelo {model} tras enviar la respuesta")
+        logger.info(f"Transcripción completada - Modelo {model} descargado para liberar memoria")
         
         return TranscriptionResponse(
             text=result["text"],
@@ -76,19 +90,13 @@ async def transcribe_audio(
         
     except HTTPException:
         # Re-lanzar errores HTTP
-        if file_path:
-            cleanup_file(file_path)
         raise
     except asyncio.CancelledError:
         # Manejar cancelación específicamente
         logger.info(f"Transcripción {task_id} fue cancelada por el usuario")
-        if file_path:
-            cleanup_file(file_path)
         raise HTTPException(status_code=499, detail="Transcripción cancelada por el usuario")
     except Exception as e:
         logger.error(f"Error en transcripción: {str(e)}")
-        if file_path:
-            cleanup_file(file_path)
         raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
 
 @router.delete("/transcribe/{task_id}")
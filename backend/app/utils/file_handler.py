@@ -1,6 +1,7 @@
 import os
 import aiofiles
 import uuid
+import subprocess
 from pathlib import Path
 from typing import Optional
 from fastapi import UploadFile, HTTPException
@@ -66,6 +67,31 @@ def cleanup_file(file_path: str) -> None:
     except Exception:
         pass  # Ignorar errores de limpieza
 
+def get_audio_duration(file_path: str) -> Optional[float]:
+    """
+    Lee la duración del audio de los metadatos del contenedor con ffprobe,
+    sin decodificar el archivo
+    
+    Returns:
+        Duración en segundos, o None si no se pudo determinar
+    """
+    try:
+        output = subprocess.run(
+            [
+                "ffprobe", "-v", "error",
+                "-show_entries", "format=duration",
+                "-of", "default=noprint_wrappers=1:nokey=1",
+                file_path
+            ],
+            capture_output=True,
+            text=True,
+            timeout=30,
+            check=True
+        ).stdout.strip()
+        return float(output)
+    except Exception:
+        return None  # ffprobe no disponible o metadatos sin duración
+
 def format_file_size(size_bytes: int) -> str:
     """Formatea el tamaño del archivo de forma legible"""
     if size_bytes < 1024:
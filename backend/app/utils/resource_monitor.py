@@ -0,0 +1,362 @@
+import os
+import re
+import time
+import cProfile
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Optional, Dict, Any, List
+
+import torch
+from fastapi import HTTPException
+
+from .file_handler import cleanup_file
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = {"cprofile", "torch"}
+SORTABLE_FIELDS = {"started_at", "wall_time", "thread_cpu_time", "process_cpu_time", "peak_rss_delta_mb", "audio_duration"}
+RSS_SAMPLE_INTERVAL = 0.1  # segundos entre muestras de memoria
+
+def _env_float(name: str, default: float = 0.0) -> float:
+    """Lee un número de una variable de entorno (vacío o inválido = valor por defecto)"""
+    value = os.getenv(name, "").strip()
+    try:
+        return float(value) if value else default
+    except ValueError:
+        logger.warning(f"Valor inválido para {name}: {value!r}, se usa {default}")
+        return default
+
+def _env_bool(name: str, default: str = "false") -> bool:
+    return os.getenv(name, default).lower() == "true"
+
+def _current_rss_mb() -> Optional[float]:
+    """Memoria residente actual del proceso en MB (None si no hay /proc, p. ej. fuera de Linux)"""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+class _RssSampler(threading.Thread):
+    """Muestrea la memoria residente en segundo plano para obtener el pico durante un trabajo"""
+
+    def __init__(self, interval: float = RSS_SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.start_rss = _current_rss_mb()
+        self.peak_rss = self.start_rss
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        rss = _current_rss_mb()
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+
+    def stop(self) -> Optional[float]:
+        """Detiene el muestreo y retorna el pico menos la memoria inicial, en MB"""
+        if self.is_alive():
+            self._stop_event.set()
+            self.join()
+        self._sample()
+        if self.start_rss is None:
+            return None
+        return self.peak_rss - self.start_rss
+
+class ResourceMonitor:
+    """
+    Contabilidad de recursos por trabajo y aplicación de límites.
+
+    Todos los límites se configuran por variables de entorno; un valor de 0
+    (o vacío) desactiva el límite correspondiente.
+    """
+
+    def __init__(self):
+        self.accounting_enabled = _env_bool("ENABLE_RESOURCE_ACCOUNTING", "true")
+        self.max_audio_duration = _env_float("MAX_AUDIO_DURATION")  # segundos
+        self.max_wall_time = _env_float("MAX_TRANSCRIPTION_TIME")  # segundos
+        self.max_jobs_per_model = int(_env_float("MAX_CONCURRENT_JOBS_PER_MODEL"))
+        self.profiling_enabled = _env_bool("ENABLE_PROFILING")
+        self.profile_dir = os.getenv("PROFILE_DIR", "profiles")
+        self.history_size = max(0, int(_env_float("JOB_HISTORY_SIZE", 200)))
+
+        self.active_jobs: Dict[str, int] = {}  # Trabajos en ejecución por modelo
+        self.throttled_jobs: Dict[str, int] = {}  # Trabajos rechazados por concurrencia (429) por modelo
+        self.jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # Historial acotado
+        self.lock = Lock()
+        # Los perfiladores son globales al proceso: solo se perfila un trabajo a la vez
+        self.profile_lock = Lock()
+        self._local = threading.local()  # Trabajo asociado al hilo actual
+
+    def acquire_slot(self, model_name: str) -> None:
+        """Reserva un hueco de ejecución para el modelo o rechaza el trabajo (429)"""
+        with self.lock:
+            running = self.active_jobs.get(model_name, 0)
+            if self.max_jobs_per_model and running >= self.max_jobs_per_model:
+                logger.warning(f"Límite de concurrencia alcanzado para el modelo {model_name} ({running})")
+                self.throttled_jobs[model_name] = self.throttled_jobs.get(model_name, 0) + 1
+                raise HTTPException(
+                    status_code=429,
+                    detail=f"Demasiadas transcripciones simultáneas con el modelo {model_name}. Inténtalo más tarde"
+                )
+            self.active_jobs[model_name] = running + 1
+
+    def release_slot(self, model_name: str) -> int:
+        """Libera el hueco reservado por acquire_slot y retorna los trabajos que siguen activos con el modelo"""
+        with self.lock:
+            running = self.active_jobs.get(model_name, 0) - 1
+            if running > 0:
+                self.active_jobs[model_name] = running
+                return running
+            self.active_jobs.pop(model_name, None)
+            return 0
+
+    def check_audio_duration(self, duration: float) -> None:
+        """Registra la duración del audio y la valida contra MAX_AUDIO_DURATION (413)"""
+        job = getattr(self._local, "job", None)
+        if job is not None:
+            job["audio_duration"] = round(duration, 2)
+        if self.max_audio_duration and duration > self.max_audio_duration:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Audio demasiado largo ({duration:.0f} s). Duración máxima: {self.max_audio_duration:.0f} s"
+            )
+
+    def mark_job(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        """Actualiza el estado de un trabajo registrado (p. ej. cuando el cliente deja de esperar)"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job["status"] = status
+                if error:
+                    job["error"] = error
+
+    @contextmanager
+    def track_job(
+        self,
+        job_id: str,
+        task_id: Optional[str],
+        model_name: str,
+        profile: Optional[str] = None
+    ):
+        """
+        Mide el coste de un trabajo ejecutado en el hilo actual
+
+        Args:
+            job_id: ID único del trabajo en el historial (el task_id lo elige el cliente y puede repetirse)
+            task_id: ID de la tarea
+            model_name: Modelo de Whisper usado
+            profile: 'cprofile', 'torch' o None para no perfilar
+
+        Yields:
+            Diccionario con el registro del trabajo
+        """
+        job: Dict[str, Any] = {
+            "job_id": job_id,
+            "task_id": task_id,
+            "model": model_name,
+            "status": "running",
+            "started_at": time.time(),
+            "audio_duration": None,
+            "wall_time": None,
+            "thread_cpu_time": None,
+            "process_cpu_time": None,
+            "peak_rss_delta_mb": None,
+            "profile_mode": profile,
+            "profile_path": None,
+            "profile_error": None,
+            "error": None,
+        }
+        if not (self.accounting_enabled or profile):
+            # Contabilidad desactivada y sin perfil: no se paga el coste de medir
+            yield job
+            return
+
+        self._store(job)
+        self._local.job = job
+
+        wall_start = time.perf_counter()
+        thread_cpu_start = time.thread_time()
+        process_cpu_start = time.process_time()
+        rss_sampler = _RssSampler()
+        if rss_sampler.start_rss is not None:
+            rss_sampler.start()
+        profiler = None
+
+        try:
+            profiler = self._start_profiler(profile, job)
+            yield job
+            self._finish(job, "completed")
+        except HTTPException as e:
+            self._finish(job, "rejected", str(e.detail))
+            raise
+        except Exception as e:
+            self._finish(job, "failed", str(e))
+            raise
+        finally:
+            if profiler is not None:
+                job["profile_path"] = self._stop_profiler(profiler, profile, job)
+                # Si el trabajo salió del historial mientras se ejecutaba, su perfil quedaría huérfano
+                with self.lock:
+                    evicted = self.jobs.get(job_id) is not job
+                if evicted and job["profile_path"]:
+                    cleanup_file(job["profile_path"])
+            job["wall_time"] = round(time.perf_counter() - wall_start, 3)
+            # process_cpu_time es la métrica de coste: incluye los hilos internos de torch,
+            # que hacen casi todo el trabajo (y también el de trabajos simultáneos).
+            # thread_cpu_time es solo el hilo que orquesta la transcripción
+            job["thread_cpu_time"] = round(time.thread_time() - thread_cpu_start, 3)
+            job["process_cpu_time"] = round(time.process_time() - process_cpu_start, 3)
+            rss_delta = rss_sampler.stop()
+            if rss_delta is not None:
+                job["peak_rss_delta_mb"] = round(rss_delta, 1)
+            self._local.job = None
+            logger.info(
+                f"Recursos tarea {task_id} - Estado: {job['status']}, Tiempo: {job['wall_time']} s, "
+                f"CPU proceso: {job['process_cpu_time']} s, Δ RSS pico: {job['peak_rss_delta_mb']} MB"
+            )
+
+    def _finish(self, job: Dict[str, Any], status: str, error: Optional[str] = None) -> None:
+        """Cierra el estado del trabajo sin pisar uno asignado desde fuera (p. ej. timeout)"""
+        with self.lock:
+            if job["status"] == "running":
+                job["status"] = status
+                job["error"] = error
+
+    def _store(self, job: Dict[str, Any]) -> None:
+        """Añade el trabajo al historial y elimina los perfiles de los trabajos que salen de él"""
+        evicted_profiles = []
+        with self.lock:
+            self.jobs[job["job_id"]] = job
+            while len(self.jobs) > self.history_size:
+                _, evicted = self.jobs.popitem(last=False)
+                if evicted.get("profile_path"):
+                    evicted_profiles.append(evicted["profile_path"])
+        for profile_path in evicted_profiles:
+            cleanup_file(profile_path)
+
+    def _start_profiler(self, profile: Optional[str], job: Dict[str, Any]):
+        """
+        Arranca el perfilador solicitado. El perfilado es opcional: si no puede
+        arrancar se registra el motivo y la transcripción continúa sin perfil.
+        """
+        if profile not in PROFILE_MODES:
+            return None
+        if not self.profile_lock.acquire(blocking=False):
+            logger.warning(f"Ya hay un trabajo perfilándose; la tarea {job['task_id']} se ejecuta sin perfil")
+            job["profile_error"] = "Ya hay otro trabajo perfilándose"
+            return None
+        try:
+            if profile == "cprofile":
+                profiler = cProfile.Profile()
+                profiler.enable()
+                return profiler
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            profiler = torch.profiler.profile(activities=activities)
+            profiler.__enter__()
+            return profiler
+        except Exception as e:
+            self.profile_lock.release()
+            logger.warning(f"No se pudo iniciar el perfilador para la tarea {job['task_id']}: {str(e)}")
+            job["profile_error"] = str(e)
+            return None
+
+    def _stop_profiler(self, profiler, profile: str, job: Dict[str, Any]) -> Optional[str]:
+        """Detiene el perfilador y guarda su salida en PROFILE_DIR"""
+        task_id = job["task_id"]
+        try:
+            profile_path = Path(self.profile_dir)
+            profile_path.mkdir(parents=True, exist_ok=True)
+            # El task_id lo envía el cliente: no debe poder salirse de PROFILE_DIR ni superar
+            # la longitud máxima de nombre de archivo. El job_id evita que dos tareas con IDs
+            # iguales o equivalentes compartan archivo
+            safe_id = re.sub(r"[^A-Za-z0-9_-]", "_", task_id or "tarea")[:64]
+            filename = f"{safe_id}-{job['job_id']}"
+            if profile == "cprofile":
+                profiler.disable()
+                output = profile_path / f"{filename}.prof"
+                profiler.dump_stats(str(output))
+            else:
+                profiler.__exit__(None, None, None)
+                output = profile_path / f"{filename}.json"
+                profiler.export_chrome_trace(str(output))
+            logger.info(f"Perfil de la tarea {task_id} guardado en {output}")
+            return str(output)
+        except Exception as e:
+            logger.error(f"Error guardando perfil de la tarea {task_id}: {str(e)}")
+            job["profile_error"] = f"Error guardando perfil: {str(e)}"
+            return None
+        finally:
+            self.profile_lock.release()
+
+    def get_jobs(self, limit: int = 50, sort_by: str = "started_at") -> List[Dict[str, Any]]:
+        """Retorna los trabajos registrados, de mayor a menor según sort_by"""
+        with self.lock:
+            jobs = [dict(job) for job in self.jobs.values()]
+        jobs.sort(key=lambda job: job.get(sort_by) or 0, reverse=True)
+        return jobs[:limit]
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Busca un trabajo por job_id o, si no existe, el más reciente con ese task_id"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                job = next((j for j in reversed(self.jobs.values()) if j["task_id"] == job_id), None)
+            return dict(job) if job is not None else None
+
+    def get_summary(self) -> Dict[str, Any]:
+        """Resumen de límites, trabajos activos y coste agregado por modelo"""
+        with self.lock:
+            jobs = [dict(job) for job in self.jobs.values()]
+            active = dict(self.active_jobs)
+            throttled = dict(self.throttled_jobs)
+
+        def model_stats(model_name: str) -> Dict[str, Any]:
+            return per_model.setdefault(model_name, {
+                "jobs": 0,
+                "total_process_cpu_time": 0.0,
+                "total_wall_time": 0.0,
+                "max_peak_rss_delta_mb": 0.0,
+                "rejected": 0,
+                "failed": 0,
+                "throttled": 0,
+            })
+
+        per_model: Dict[str, Dict[str, Any]] = {}
+        for model_name, count in throttled.items():
+            model_stats(model_name)["throttled"] = count
+        for job in jobs:
+            stats = model_stats(job["model"])
+            stats["jobs"] += 1
+            stats["total_process_cpu_time"] = round(stats["total_process_cpu_time"] + (job["process_cpu_time"] or 0), 3)
+            stats["total_wall_time"] = round(stats["total_wall_time"] + (job["wall_time"] or 0), 3)
+            stats["max_peak_rss_delta_mb"] = max(stats["max_peak_rss_delta_mb"], job["peak_rss_delta_mb"] or 0)
+            if job["status"] in ("rejected", "failed"):
+                stats[job["status"]] += 1
+
+        return {
+            "limits": {
+                "max_audio_duration": self.max_audio_duration or None,
+                "max_transcription_time": self.max_wall_time or None,
+                "max_concurrent_jobs_per_model": self.max_jobs_per_model or None,
+            },
+            "accounting_enabled": self.accounting_enabled,
+            "profiling_enabled": self.profiling_enabled,
+            "active_jobs": active,
+            "torch_threads": torch.get_num_threads(),
+            "torch_interop_threads": torch.get_num_interop_threads(),
+            "models": per_model,
+        }
+
+# Instancia global del monitor
+resource_monitor = ResourceMonitor()
@@ -4,10 +4,15 @@ import os
 import logging
 import threading
 import asyncio
+import uuid
 from typing import Optional, Dict, Any
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, Future
 from threading import Lock
+from fastapi import HTTPException
+
+from .resource_monitor import resource_monitor
+from .file_handler import get_audio_duration, cleanup_file
 
 logger = logging.getLogger(__name__)
 
@@ -61,6 +66,17 @@ class WhisperService:
             Diccionario con el resultado de la transcripción
         """
         try:
+            # Rechazar pronto con los metadatos antes de decodificar: decodificar
+            # un audio muy largo ya consume gigas de memoria
+            duration = get_audio_duration(audio_path)
+            if duration is not None:
+                resource_monitor.check_audio_duration(duration)
+            
+            # Los metadatos pueden estar falsificados o ser una estimación (MP3 sin
+            # cabecera Xing/VBRI): el límite se aplica siempre sobre el audio decodificado
+            audio = whisper.load_audio(audio_path)
+            resource_monitor.check_audio_duration(len(audio) / whisper.audio.SAMPLE_RATE)
+            
             model = self.load_model(model_name)
             
             # Opciones para la transcripción
@@ -75,7 +91,7 @@ class WhisperService:
             logger.info(f"Transcribiendo archivo: {audio_path}")
             logger.info(f"Opciones: {options}")
             
-            result = model.transcribe(audio_path, **options)
+            result = model.transcribe(audio, **options)
             
             return {
                 "text": result["text"].strip(),
@@ -84,17 +100,34 @@ class WhisperService:
                 "duration": self._get_audio_duration(result)
             }
             
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error en transcripción: {str(e)}")
             raise
 
+    def _run_job(
+        self,
+        audio_path: str,
+        model_name: str,
+        language: Optional[str],
+        task: str,
+        job_id: str,
+        task_id: Optional[str],
+        profile: Optional[str]
+    ) -> Dict[str, Any]:
+        """Ejecuta una transcripción en el hilo de trabajo midiendo sus recursos"""
+        with resource_monitor.track_job(job_id, task_id, model_name, profile):
+            return self.transcribe_audio(audio_path, model_name, language, task)
+
     async def transcribe_audio_async(
         self, 
         audio_path: str, 
         model_name: str = "base",
         language: Optional[str] = None,
         task: str = "transcribe",
-        task_id: Optional[str] = None
+        task_id: Optional[str] = None,
+        profile: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Transcribe un archivo de audio usando Whisper de forma asíncrona
@@ -105,22 +138,38 @@ class WhisperService:
             language: Idioma del audio (opcional, se detecta automáticamente)
             task: 'transcribe' o 'translate'
             task_id: ID único para la tarea (para cancelación)
+            profile: 'cprofile' o 'torch' para guardar un perfil de la tarea (opcional)
+        
+        El servicio se encarga de eliminar audio_path y descargar el modelo cuando
+        el hilo de trabajo termina de verdad, no cuando el cliente deja de esperar.
         
         Returns:
             Diccionario con el resultado de la transcripción
         """
-        import asyncio
-        loop = asyncio.get_event_loop()
-        
-        # Crear future para la transcripción
-        future = loop.run_in_executor(
-            self.executor, 
-            self.transcribe_audio, 
-            audio_path, 
-            model_name, 
-            language, 
-            task
-        )
+        # Reservar un hueco para el modelo; se libera junto con el archivo y el modelo
+        # cuando el hilo termina
+        try:
+            resource_monitor.acquire_slot(model_name)
+        except HTTPException:
+            cleanup_file(audio_path)
+            raise
+        job_id = uuid.uuid4().hex
+        try:
+            job = self.executor.submit(
+                self._run_job,
+                audio_path,
+                model_name,
+                language,
+                task,
+                job_id,
+                task_id,
+                profile
+            )
+        except Exception:
+            self._finish_job(model_name, audio_path)
+            raise
+        job.add_done_callback(lambda _: self._finish_job(model_name, audio_path))
+        future = asyncio.wrap_future(job)
         
         # Registrar la tarea si se proporciona un ID
         if task_id:
@@ -128,8 +177,16 @@ class WhisperService:
                 self.active_tasks[task_id] = future
                 
         try:
-            result = await future
+            timeout = resource_monitor.max_wall_time or None
+            result = await asyncio.wait_for(future, timeout=timeout)
             return result
+        except asyncio.TimeoutError:
+            logger.warning(f"Transcripción {task_id} superó el tiempo máximo de {timeout} s")
+            resource_monitor.mark_job(job_id, "timeout", "Tiempo máximo de transcripción superado")
+            raise HTTPException(
+                status_code=504,
+                detail=f"La transcripción superó el tiempo máximo permitido ({timeout:.0f} s)"
+            )
         except asyncio.CancelledError:
             logger.info(f"Transcripción cancelada para tarea {task_id}")
             raise
@@ -139,6 +196,14 @@ class WhisperService:
                 with self.task_lock:
                     self.active_tasks.pop(task_id, None)
     
+    def _finish_job(self, model_name: str, audio_path: str):
+        """Libera el hueco del modelo, elimina el audio y descarga el modelo si ya nadie lo usa"""
+        remaining = resource_monitor.release_slot(model_name)
+        cleanup_file(audio_path)
+        # Descargarlo con otros trabajos en curso haría que el siguiente cargara una segunda copia
+        if remaining == 0:
+            self.unload_model(model_name)
+    
     def cancel_transcription(self, task_id: str) -> bool:
         """
         Cancela una transcripción en progreso